@@ -1,7 +1,61 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.contrib.auth.models import User
+from django.db import IntegrityError, router, transaction
+from django.http import HttpResponseRedirect
 
 from .models import Book, Genre, Loan
 
+DELETE_RACED_MESSAGE = 'A loan was taken out while you were confirming; nothing was deleted.'
+
+
+class ActiveLoanDeleteMixin:
+    """
+    admin deletes that stop at active loans instead of failing with a 500.
+
+    - the library_loan_protect_active trigger rejects deleting an active
+      loan, including via a cascade from its book or member.
+    - active loans are listed as protected objects, so the admin shows its
+      "cannot delete" page for both the delete view and "delete selected".
+    - a loan taken out between confirming and deleting still trips the
+      trigger; the whole delete is rolled back and reported as an error.
+    """
+    # lookup from Loan to the objects this admin deletes
+    active_loan_lookup = None
+
+    def _active_loans(self, objs):
+        pks = [obj.pk for obj in objs]
+        return (
+            Loan.objects
+            .filter(**{f'{self.active_loan_lookup}__in': pks}, is_active=True)
+            .select_related('member', 'book')
+        )
+
+    def get_deleted_objects(self, objs, request):
+        deleted_objects, model_count, perms_needed, protected = super().get_deleted_objects(objs, request)
+        active = [f'Active loan: {loan}' for loan in self._active_loans(objs)]
+        return deleted_objects, model_count, perms_needed, [*protected, *active]
+
+    # the error escapes the admin's own atomic block, so the deletion log
+    # entry rolls back with the delete and no success message is sent
+    def delete_view(self, request, object_id, extra_context=None):
+        try:
+            return super().delete_view(request, object_id, extra_context)
+        except IntegrityError:
+            self.message_user(request, DELETE_RACED_MESSAGE, messages.ERROR)
+            # the confirmation page now lists the loan as protected
+            return HttpResponseRedirect(request.get_full_path())
+
+    def response_action(self, request, queryset):
+        # unlike delete_view, actions run outside a transaction, so wrap them
+        # to roll the log entries back along with a failed "delete selected"
+        try:
+            with transaction.atomic(using=router.db_for_write(self.model)):
+                return super().response_action(request, queryset)
+        except IntegrityError:
+            self.message_user(request, DELETE_RACED_MESSAGE, messages.ERROR)
+            return HttpResponseRedirect(request.get_full_path())
+
 
 @admin.register(Genre)
 class GenreAdmin(admin.ModelAdmin):
@@ -10,22 +64,32 @@ class GenreAdmin(admin.ModelAdmin):
 
 
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(ActiveLoanDeleteMixin, admin.ModelAdmin):
+    active_loan_lookup = 'book'
     list_display = (
         'title',
         'author',
         'isbn',
         'total_copies',
         'available_copies',
+        'genre_list',
         'added_at',
     )
     list_filter = ('genres',)
     search_fields = ('title', 'author', 'isbn')
     filter_horizontal = ('genres',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('genres')
+
+    @admin.display(description='Genres')
+    def genre_list(self, obj):
+        return ', '.join(genre.name for genre in obj.genres.all())
+
 
 @admin.register(Loan)
-class LoanAdmin(admin.ModelAdmin):
+class LoanAdmin(ActiveLoanDeleteMixin, admin.ModelAdmin):
+    active_loan_lookup = 'pk'
     list_display = (
         'member',
         'book',
@@ -34,5 +98,14 @@ class LoanAdmin(admin.ModelAdmin):
         'is_active',
     )
     list_filter = ('is_active',)
+    list_select_related = ('member', 'book')
     search_fields = ('member__username', 'book__title')
     raw_id_fields = ('member', 'book')
+
+
+admin.site.unregister(User)
+
+
+@admin.register(User)
+class UserAdmin(ActiveLoanDeleteMixin, BaseUserAdmin):
+    active_loan_lookup = 'member'
@@ -1,6 +1,8 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.urls import reverse_lazy
+from django.utils.translation import ngettext
 
 from .models import Book, Loan
 
@@ -29,21 +31,56 @@ class BookForm(forms.ModelForm):
                 raise forms.ValidationError(
                     'Available copies cannot exceed total copies.'
                 )
+            # copies out on loan come back on return, so leave room for them
+            if self.instance.pk:
+                on_loan = self.instance.loans.filter(is_active=True).count()
+                if total - available < on_loan:
+                    raise forms.ValidationError(
+                        ngettext(
+                            '%(on_loan)d copy is on loan, so available copies cannot exceed %(limit)d.',
+                            '%(on_loan)d copies are on loan, so available copies cannot exceed %(limit)d.',
+                            on_loan,
+                        ),
+                        params={'on_loan': on_loan, 'limit': total - on_loan},
+                    )
         return cleaned_data
 
 
 class AssignLoanForm(forms.Form):
+    # plain id inputs backed by the staff search endpoints, so rendering the
+    # form never serializes every member and book into <option>s
     member = forms.ModelChoiceField(
-        queryset=User.objects.filter(is_staff=False, is_active=True),
+        queryset=User.objects.none(),
         label='Member',
-        empty_label='Select a member',
+        widget=forms.TextInput(attrs={
+            'data-autocomplete-url': reverse_lazy('library:staff_user_search'),
+            'placeholder': 'Start typing a username',
+            'autocomplete': 'off',
+        }),
     )
     book = forms.ModelChoiceField(
-        queryset=Book.objects.filter(available_copies__gt=0),
+        queryset=Book.objects.none(),
         label='Book',
-        empty_label='Select a book',
+        widget=forms.TextInput(attrs={
+            'data-autocomplete-url': reverse_lazy('library:staff_book_search'),
+            'placeholder': 'Start typing a title',
+            'autocomplete': 'off',
+        }),
     )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['member'].queryset = (
+            User.objects
+            .filter(is_staff=False, is_active=True)
+            .only('id', 'username')
+        )
+        self.fields['book'].queryset = (
+            Book.objects
+            .filter(available_copies__gt=0)
+            .only('id', 'title', 'author', 'available_copies')
+        )
+
     def clean(self):
         cleaned_data = super().clean()
         member = cleaned_data.get('member')
@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
 from library.models import Book, Genre
 
@@ -153,39 +154,60 @@ class Command(BaseCommand):
     help = "Populate the library with NYT bestselling books"
 
     def handle(self, *args, **options):
-        created_books = 0
-        skipped_books = 0
-        genre_cache = {}
+        isbns = [book_data["isbn"] for book_data in BOOKS]
+        unique_genres = {name for book_data in BOOKS for name in book_data["genres"]}
 
-        for book_data in BOOKS:
-            genres = []
-            for genre_name in book_data["genres"]:
-                if genre_name not in genre_cache:
-                    genre_obj, _ = Genre.objects.get_or_create(name=genre_name)
-                    genre_cache[genre_name] = genre_obj
-                genres.append(genre_cache[genre_name])
+        with transaction.atomic():
+            # one INSERT for every genre, existing names are left untouched
+            Genre.objects.bulk_create(
+                [Genre(name=name) for name in unique_genres],
+                ignore_conflicts=True,
+            )
+            genre_map = dict(
+                Genre.objects
+                .filter(name__in=unique_genres)
+                .values_list('name', 'id')
+            )
 
-            copies = book_data["total_copies"]
-            book, created = Book.objects.get_or_create(
-                title=book_data["title"],
-                author=book_data["author"],
-                defaults={
-                    "isbn": book_data["isbn"],
-                    "total_copies": copies,
-                    "available_copies": copies,
-                },
+            existing = Book.objects.only('title', 'author', 'isbn').in_bulk(isbns, field_name='isbn')
+            new_books = [
+                Book(
+                    title=book_data["title"],
+                    author=book_data["author"],
+                    isbn=book_data["isbn"],
+                    total_copies=book_data["total_copies"],
+                    available_copies=book_data["total_copies"],
+                )
+                for book_data in BOOKS
+                if book_data["isbn"] not in existing
+            ]
+            Book.objects.bulk_create(new_books, ignore_conflicts=True)
+
+            # ignore_conflicts leaves pks unset, so re-fetch the new ids by isbn
+            book_map = dict(
+                Book.objects
+                .filter(isbn__in=[book.isbn for book in new_books])
+                .values_list('isbn', 'id')
+            )
+            BookGenre = Book.genres.through
+            BookGenre.objects.bulk_create(
+                [
+                    BookGenre(book_id=book_map[book_data["isbn"]], genre_id=genre_map[name])
+                    for book_data in BOOKS
+                    if book_data["isbn"] in book_map
+                    for name in book_data["genres"]
+                ],
+                ignore_conflicts=True,
             )
 
-            if created:
-                book.genres.set(genres)
-                created_books += 1
-                self.stdout.write(f"  Created: {book}")
-            else:
-                skipped_books += 1
-                self.stdout.write(f"  Skipped (already exists): {book}")
+        for book in new_books:
+            self.stdout.write(f"  Created: {book}")
+        for isbn in isbns:
+            if isbn in existing:
+                self.stdout.write(f"  Skipped (already exists): {existing[isbn]}")
 
         self.stdout.write(
             self.style.SUCCESS(
-                f"\nDone. {created_books} book(s) created, {skipped_books} skipped."
+                f"\nDone. {len(new_books)} book(s) created, {len(existing)} skipped."
             )
         )
@@ -0,0 +1,21 @@
+# Generated by Django 6.0.2 on 2026-10-15 22:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0004_book_avail_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='book',
+            name='available_copies_non_negative',
+        ),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.CheckConstraint(condition=models.Q(('available_copies__lte', models.F('total_copies'))), name='available_le_total'),
+        ),
+    ]
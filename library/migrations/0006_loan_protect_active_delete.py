@@ -0,0 +1,34 @@
+# Generated by Django 6.0.2 on 2026-10-15 23:10
+
+from django.db import migrations
+
+CREATE_TRIGGER = """
+CREATE FUNCTION library_loan_protect_active() RETURNS trigger AS $$
+BEGIN
+    RAISE EXCEPTION 'active loan % cannot be deleted', OLD.id
+        USING ERRCODE = 'restrict_violation';
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER library_loan_protect_active
+    BEFORE DELETE ON library_loan
+    FOR EACH ROW
+    WHEN (OLD.is_active)
+    EXECUTE FUNCTION library_loan_protect_active();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS library_loan_protect_active ON library_loan;
+DROP FUNCTION IF EXISTS library_loan_protect_active();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_book_available_le_total'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+    ]
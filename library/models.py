@@ -1,6 +1,6 @@
 from django.conf import settings
 from django.db import models
-from django.db.models import Q
+from django.db.models import F, Q
 
 
 class Genre(models.Model):
@@ -27,9 +27,17 @@ class Book(models.Model):
     class Meta:
         ordering = ['title']
         constraints = [
+            # available_copies >= 0 is already enforced by PositiveIntegerField
             models.CheckConstraint(
-                condition=Q(available_copies__gte=0),
-                name='available_copies_non_negative',
+                condition=Q(available_copies__lte=F('total_copies')),
+                name='available_le_total',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['id'],
+                name='book_avail_idx',
+                condition=Q(available_copies__gt=0),
             ),
         ]
 
@@ -62,6 +70,15 @@ class Loan(models.Model):
                 name='unique_active_loan_per_member_book',
             ),
         ]
+        indexes = [
+            models.Index(fields=['member', 'is_active'], name='loan_member_active_idx'),
+            models.Index(fields=['book', 'is_active'], name='loan_book_active_idx'),
+            models.Index(
+                fields=['is_active', '-checked_out_at'],
+                name='loan_active_recent_idx',
+                condition=Q(is_active=True),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.member.username} — {self.book.title}"
@@ -0,0 +1,35 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# below this many rows an exact COUNT(*) is cheap and more accurate
+ESTIMATE_THRESHOLD = 10_000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    paginator that skips the exact COUNT(*) for unfiltered PostgreSQL tables.
+
+    - filtered querysets (e.g. ?status=active) are counted exactly; the
+      partial loan index keeps the active count small.
+    - unfiltered querysets use the planner's row estimate from pg_class once
+      the table is large enough for the estimate to be worth the inaccuracy.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.has_filters():
+            return super().count
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        estimate = row[0] if row else 0
+        if estimate < ESTIMATE_THRESHOLD:
+            return super().count
+        return estimate
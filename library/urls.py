@@ -15,15 +15,19 @@ urlpatterns = [
 
     # staff URLs books
     path('staff/books/', views.StaffBookListView.as_view(), name='staff_book_list'),
+    path('staff/books/search/', views.StaffBookSearchView.as_view(), name='staff_book_search'),
     path('staff/books/add/', views.StaffBookCreateView.as_view(), name='staff_book_add'),
     path('staff/books/<int:pk>/edit/', views.StaffBookUpdateView.as_view(), name='staff_book_edit'),
     path('staff/books/<int:pk>/delete/', views.StaffBookDeleteView.as_view(), name='staff_book_delete'),
 
     # staff URLs loans
     path('staff/loans/', views.StaffLoanListView.as_view(), name='staff_loan_list'),
+    path('staff/loans/export/', views.StaffLoanExportView.as_view(), name='staff_loan_export'),
     path('staff/loans/assign/', views.StaffLoanAssignView.as_view(), name='staff_loan_assign'),
+    path('staff/loans/force-return/', views.StaffBulkForceReturnView.as_view(), name='staff_loan_bulk_force_return'),
     path('staff/loans/<int:pk>/force-return/', views.StaffForceReturnView.as_view(), name='staff_loan_force_return'),
 
     # staff URLs users
     path('staff/users/', views.StaffUserListView.as_view(), name='staff_user_list'),
+    path('staff/users/search/', views.StaffUserSearchView.as_view(), name='staff_user_search'),
 ]
@@ -1,19 +1,44 @@
+import csv
+from collections import Counter
+
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib.auth.views import LoginView
-from django.db import IntegrityError, transaction
-from django.db.models import Count, Q
-from django.http import Http404, HttpResponseNotAllowed
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, Exists, F, FilteredRelation, OuterRef, Prefetch, Q, Value, When
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import get_template, render_to_string
 from django.urls import reverse_lazy
 from django.utils import timezone
 from django.views import View
+from django.views.decorators.http import require_POST
 from django.views.generic import CreateView, DeleteView, FormView, ListView, UpdateView
 
 from .forms import AssignLoanForm, BookForm, RegistrationForm
 from .mixins import StaffRequiredMixin
 from .models import Book, Loan
+from .pagination import EstimatedCountPaginator
+
+STAFF_BOOK_LIST_URL = reverse_lazy('library:staff_book_list')
+STAFF_LOAN_LIST_URL = reverse_lazy('library:staff_loan_list')
+STAFF_LOAN_ASSIGN_URL = reverse_lazy('library:staff_loan_assign')
+MY_LOANS_URL = reverse_lazy('library:my_loans')
+# per-object route, reversed with pk at redirect time
+BOOK_DETAIL_ROUTE = 'library:book_detail'
+
+RETURN_BLOCKED_MESSAGE = (
+    'This loan could not be returned: the book has no room for the returned '
+    'copy. Staff need to correct its copy counts first.'
+)
+
+# max rows returned by the staff autocomplete endpoints
+SEARCH_LIMIT = 20
+
+# placeholder a streamed page template is split on around its rows
+ROWS_MARKER = '<!-- rows -->'
 
 
 # auth
@@ -30,24 +55,70 @@ class CustomLoginView(LoginView):
         # staff users land on Manage Books
         # members land on the catalogue
         if self.request.user.is_staff:
-            return reverse_lazy('library:staff_book_list')
+            return STAFF_BOOK_LIST_URL
         return reverse_lazy('library:book_list')
 
 
 # helpers
-def _execute_checkout(member, book_pk):
-    book = Book.objects.select_for_update().get(pk=book_pk)
+def _book_list_queryset():
+    # list pages only render these columns and the genre names, aggregated in
+    # the same query instead of a prefetch
+    return (
+        Book.objects
+        .only('title', 'author', 'isbn', 'total_copies', 'available_copies')
+        .annotate(genre_names=ArrayAgg(
+            'genres__name',
+            distinct=True,
+            filter=Q(genres__isnull=False),
+            order_by='genres__name',
+            default=[],
+        ))
+    )
 
-    if book.available_copies <= 0:
-        raise ValueError('No copies currently available.')
 
-    if Loan.objects.filter(member=member, book=book, is_active=True).exists():
-        raise ValueError('This member already has an active loan for this book.')
+def _loan_list_queryset(status):
+    qs = (
+        Loan.objects
+        .select_related('book', 'member')
+        .only(
+            'id', 'is_active', 'checked_out_at', 'returned_at',
+            'book__id', 'book__title', 'member__id', 'member__username',
+        )
+    )
+    if status == 'active':
+        qs = qs.filter(is_active=True)
+    elif status == 'returned':
+        qs = qs.filter(is_active=False)
+    return qs
 
-    loan = Loan.objects.create(member=member, book=book)
-    book.available_copies -= 1
-    book.save(update_fields=['available_copies'])
-    return loan
+
+class _Echo:
+    """file-like object for csv.writer that hands each line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def _execute_checkout(member, book_pk):
+    # the WHERE clause enforces availability and takes the row lock, and
+    # RETURNING hands back the title so no separate SELECT is needed
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {Book._meta.db_table} '
+            'SET available_copies = available_copies - 1 '
+            'WHERE id = %s AND available_copies > 0 '
+            'RETURNING title',
+            [book_pk],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        if not Book.objects.filter(pk=book_pk).exists():
+            raise Book.DoesNotExist
+        raise ValueError('No copies currently available.')
+
+    # duplicate active loans are rejected by the partial unique constraint
+    loan = Loan.objects.create(member=member, book_id=book_pk)
+    return loan, row[0]
 
 
 def _execute_return(loan_pk, *, scope_filter=None):
@@ -55,21 +126,50 @@ def _execute_return(loan_pk, *, scope_filter=None):
     if scope_filter:
         lookup.update(scope_filter)
 
+    updated = Loan.objects.filter(**lookup).update(
+        is_active=False,
+        returned_at=timezone.now(),
+    )
+    if not updated:
+        raise Loan.DoesNotExist
+
+    # only what the callers' flash messages need
     loan = (
         Loan.objects
-        .select_for_update()
-        .select_related('book')
-        .get(**lookup)
+        .select_related('book', 'member')
+        .only('id', 'book__title', 'member__username')
+        .get(pk=loan_pk)
+    )
+    Book.objects.filter(pk=loan.book_id).update(
+        available_copies=F('available_copies') + 1,
     )
-    book = Book.objects.select_for_update().get(pk=loan.book_id)
+    return loan
 
-    loan.is_active = False
-    loan.returned_at = timezone.now()
-    loan.save(update_fields=['is_active', 'returned_at'])
 
-    book.available_copies += 1
-    book.save(update_fields=['available_copies'])
-    return loan
+def _bulk_force_return(loan_ids):
+    # a loan locked by a concurrent return is being closed by that
+    # transaction already, so skip it rather than wait for its lock
+    loans = list(
+        Loan.objects
+        .select_for_update(skip_locked=True)
+        .filter(pk__in=loan_ids, is_active=True)
+        .values_list('id', 'book_id')
+    )
+    if not loans:
+        return 0
+
+    Loan.objects.filter(pk__in=[loan_id for loan_id, _ in loans]).update(
+        is_active=False,
+        returned_at=timezone.now(),
+    )
+    # one UPDATE for every affected book, each incremented by its own count
+    returned = Counter(book_id for _, book_id in loans)
+    Book.objects.filter(pk__in=returned).update(
+        available_copies=F('available_copies') + Case(
+            *[When(pk=book_id, then=Value(count)) for book_id, count in returned.items()],
+        ),
+    )
+    return len(loans)
 
 
 # public/member views
@@ -86,16 +186,25 @@ def register_view(request):
 
 @login_required
 def book_list_view(request):
-    books = Book.objects.prefetch_related('genres').all()
+    active_loan = Loan.objects.filter(
+        member=request.user, book=OuterRef('pk'), is_active=True
+    )
+    books = _book_list_queryset().annotate(has_active_loan=Exists(active_loan))
     return render(request, 'library/book_list.html', {'books': books})
 
 
 @login_required
 def book_detail_view(request, pk):
-    book = get_object_or_404(Book.objects.prefetch_related('genres'), pk=pk)
-    has_active_loan = Loan.objects.filter(
-        member=request.user, book=book, is_active=True
-    ).exists()
+    active_loan = Loan.objects.filter(
+        member=request.user, book=OuterRef('pk'), is_active=True
+    )
+    book = get_object_or_404(
+        Book.objects
+        .prefetch_related('genres')
+        .annotate(has_active_loan=Exists(active_loan)),
+        pk=pk,
+    )
+    has_active_loan = book.has_active_loan
     can_checkout = book.available_copies > 0 and not has_active_loan
     return render(request, 'library/book_detail.html', {
         'book': book,
@@ -105,53 +214,53 @@ def book_detail_view(request, pk):
 
 
 @login_required
+@require_POST
 def book_checkout_view(request, pk):
-    if request.method != 'POST':
-        return HttpResponseNotAllowed(['POST'])
-
     try:
         with transaction.atomic():
-            loan = _execute_checkout(request.user, pk)
+            _, title = _execute_checkout(request.user, pk)
     except Book.DoesNotExist:
         raise Http404
     except ValueError as exc:
         messages.error(request, str(exc))
-        return redirect('library:book_detail', pk=pk)
+        return redirect(BOOK_DETAIL_ROUTE, pk=pk)
     except IntegrityError:
         messages.error(request, 'You already have this book checked out.')
-        return redirect('library:book_detail', pk=pk)
+        return redirect(BOOK_DETAIL_ROUTE, pk=pk)
 
-    messages.success(request, f'You have checked out "{loan.book.title}".')
-    return redirect('library:book_detail', pk=pk)
+    messages.success(request, f'You have checked out "{title}".')
+    return redirect(BOOK_DETAIL_ROUTE, pk=pk)
 
 
 @login_required
+@require_POST
 def loan_return_view(request, pk):
-    if request.method != 'POST':
-        return HttpResponseNotAllowed(['POST'])
-
     try:
         with transaction.atomic():
             loan = _execute_return(pk, scope_filter={'member': request.user})
     except Loan.DoesNotExist:
         raise Http404
+    except IntegrityError:
+        # the book's counts leave no room for the copy (available_le_total)
+        messages.error(request, RETURN_BLOCKED_MESSAGE)
+        return redirect(MY_LOANS_URL)
 
     messages.success(request, f'You have returned "{loan.book.title}".')
-    return redirect('library:my_loans')
+    return redirect(MY_LOANS_URL)
 
 
 @login_required
 def my_loans_view(request):
-    active_loans = (
-        Loan.objects
-        .filter(member=request.user, is_active=True)
-        .select_related('book')
-    )
-    past_loans = (
+    # one query for both tables, split in Python
+    loans = list(
         Loan.objects
-        .filter(member=request.user, is_active=False)
+        .filter(member=request.user)
         .select_related('book')
+        .only('id', 'is_active', 'checked_out_at', 'returned_at', 'book__id', 'book__title')
+        .order_by('-is_active', '-checked_out_at')
     )
+    active_loans = [loan for loan in loans if loan.is_active]
+    past_loans = [loan for loan in loans if not loan.is_active]
     return render(request, 'library/my_loans.html', {
         'active_loans': active_loans,
         'past_loans': past_loans,
@@ -159,20 +268,44 @@ def my_loans_view(request):
 
 
 # staff views books
-class StaffBookListView(StaffRequiredMixin, ListView):
-    model = Book
+class StaffBookListView(StaffRequiredMixin, View):
+    """
+    streams the book table so memory stays flat however large the catalogue.
+
+    - the page template is rendered once and split at ROWS_MARKER.
+    - rows are rendered from the row template as they come off the cursor.
+    """
     template_name = 'library/staff/book_list.html'
-    context_object_name = 'books'
+    row_template_name = 'library/staff/_book_row.html'
+    chunk_size = 200
 
     def get_queryset(self):
-        return Book.objects.prefetch_related('genres').all()
+        return _book_list_queryset()
+
+    def get(self, request):
+        page = render_to_string(
+            self.template_name, {'rows_marker': ROWS_MARKER}, request=request
+        )
+        header, footer = page.split(ROWS_MARKER)
+        return StreamingHttpResponse(self._stream(header, footer))
+
+    def _stream(self, header, footer):
+        row_template = get_template(self.row_template_name)
+        yield header
+        empty = True
+        for book in self.get_queryset().iterator(chunk_size=self.chunk_size):
+            empty = False
+            yield row_template.render({'book': book})
+        if empty:
+            yield row_template.render({'book': None})
+        yield footer
 
 
 class StaffBookCreateView(StaffRequiredMixin, CreateView):
     model = Book
     form_class = BookForm
     template_name = 'library/staff/book_form.html'
-    success_url = reverse_lazy('library:staff_book_list')
+    success_url = STAFF_BOOK_LIST_URL
 
     def form_valid(self, form):
         response = super().form_valid(form)
@@ -184,7 +317,7 @@ class StaffBookUpdateView(StaffRequiredMixin, UpdateView):
     model = Book
     form_class = BookForm
     template_name = 'library/staff/book_form.html'
-    success_url = reverse_lazy('library:staff_book_list')
+    success_url = STAFF_BOOK_LIST_URL
 
     def form_valid(self, form):
         response = super().form_valid(form)
@@ -195,17 +328,38 @@ class StaffBookUpdateView(StaffRequiredMixin, UpdateView):
 class StaffBookDeleteView(StaffRequiredMixin, DeleteView):
     model = Book
     template_name = 'library/staff/book_confirm_delete.html'
-    success_url = reverse_lazy('library:staff_book_list')
+    success_url = STAFF_BOOK_LIST_URL
 
     def form_valid(self, form):
-        if self.object.loans.filter(is_active=True).exists():
+        # a database trigger refuses to delete active loans, so the cascade
+        # from the book fails atomically instead of being pre-checked here
+        try:
+            with transaction.atomic():
+                response = super().form_valid(form)
+        except IntegrityError:
             messages.error(
                 self.request,
                 'Cannot delete this book — it has active loans.'
             )
-            return redirect('library:staff_book_list')
+            return redirect(STAFF_BOOK_LIST_URL)
         messages.success(self.request, f'Book "{self.object.title}" has been deleted.')
-        return super().form_valid(form)
+        return response
+
+
+class StaffBookSearchView(StaffRequiredMixin, View):
+
+    def get(self, request):
+        q = request.GET.get('q', '').strip()
+        books = (
+            Book.objects
+            .filter(available_copies__gt=0, title__istartswith=q)
+            .values('id', 'title', 'author')[:SEARCH_LIMIT]
+        )
+        results = [
+            {'id': book['id'], 'label': f"{book['title']} by {book['author']}"}
+            for book in books
+        ]
+        return JsonResponse({'results': results})
 
 
 # staff views loans
@@ -213,15 +367,11 @@ class StaffLoanListView(StaffRequiredMixin, ListView):
     model = Loan
     template_name = 'library/staff/loan_list.html'
     context_object_name = 'loans'
+    paginate_by = 50
+    paginator_class = EstimatedCountPaginator
 
     def get_queryset(self):
-        qs = Loan.objects.select_related('book', 'member').all()
-        status = self.request.GET.get('status')
-        if status == 'active':
-            qs = qs.filter(is_active=True)
-        elif status == 'returned':
-            qs = qs.filter(is_active=False)
-        return qs
+        return _loan_list_queryset(self.request.GET.get('status'))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -229,10 +379,36 @@ class StaffLoanListView(StaffRequiredMixin, ListView):
         return context
 
 
+class StaffLoanExportView(StaffRequiredMixin, View):
+    """streams the (optionally status-filtered) loan list as CSV."""
+    chunk_size = 500
+
+    def get(self, request):
+        writer = csv.writer(_Echo())
+        loans = _loan_list_queryset(request.GET.get('status'))
+        response = StreamingHttpResponse(
+            (writer.writerow(row) for row in self._rows(loans)),
+            content_type='text/csv',
+        )
+        response['Content-Disposition'] = 'attachment; filename="loans.csv"'
+        return response
+
+    def _rows(self, loans):
+        yield ['Book', 'Member', 'Checked Out', 'Returned', 'Status']
+        for loan in loans.iterator(chunk_size=self.chunk_size):
+            yield [
+                loan.book.title,
+                loan.member.username,
+                loan.checked_out_at.isoformat(),
+                loan.returned_at.isoformat() if loan.returned_at else '',
+                'Active' if loan.is_active else 'Returned',
+            ]
+
+
 class StaffLoanAssignView(StaffRequiredMixin, FormView):
     form_class = AssignLoanForm
     template_name = 'library/staff/loan_assign.html'
-    success_url = reverse_lazy('library:staff_loan_list')
+    success_url = STAFF_LOAN_LIST_URL
 
     def form_valid(self, form):
         member = form.cleaned_data['member']
@@ -243,13 +419,13 @@ class StaffLoanAssignView(StaffRequiredMixin, FormView):
                 _execute_checkout(member, book.pk)
         except ValueError as exc:
             messages.error(self.request, str(exc))
-            return redirect('library:staff_loan_assign')
+            return redirect(STAFF_LOAN_ASSIGN_URL)
         except IntegrityError:
             messages.error(
                 self.request,
                 'This member already has an active loan for this book.'
             )
-            return redirect('library:staff_loan_assign')
+            return redirect(STAFF_LOAN_ASSIGN_URL)
 
         messages.success(
             self.request,
@@ -266,12 +442,51 @@ class StaffForceReturnView(StaffRequiredMixin, View):
                 loan = _execute_return(pk)
         except Loan.DoesNotExist:
             raise Http404
+        except IntegrityError:
+            messages.error(request, RETURN_BLOCKED_MESSAGE)
+            return redirect(STAFF_LOAN_LIST_URL)
 
         messages.success(
             request,
             f'Loan for "{loan.book.title}" by {loan.member.username} has been returned.'
         )
-        return redirect('library:staff_loan_list')
+        return redirect(STAFF_LOAN_LIST_URL)
+
+
+class StaffBulkForceReturnView(StaffRequiredMixin, View):
+
+    def post(self, request):
+        loan_ids = [
+            int(loan_id) for loan_id in request.POST.getlist('loan_ids')
+            if loan_id.isdigit()
+        ]
+        if not loan_ids:
+            messages.error(request, 'No loans selected.')
+            return redirect(STAFF_LOAN_LIST_URL)
+
+        try:
+            with transaction.atomic():
+                returned = _bulk_force_return(loan_ids)
+        except IntegrityError:
+            messages.error(
+                request,
+                'No loans were returned: a selected book has no room for the '
+                'returned copy. Correct its copy counts and try again.'
+            )
+            return redirect(STAFF_LOAN_LIST_URL)
+
+        # already-returned or unknown ids are skipped, so say when some were
+        if returned == 0:
+            messages.error(request, 'None of the selected loans were active, so nothing was returned.')
+        elif returned < len(loan_ids):
+            messages.warning(
+                request,
+                f'{returned} of {len(loan_ids)} selected loan(s) have been returned; '
+                'the rest were not active.'
+            )
+        else:
+            messages.success(request, f'{returned} loan(s) have been returned.')
+        return redirect(STAFF_LOAN_LIST_URL)
 
 
 # staff views users
@@ -284,6 +499,35 @@ class StaffUserListView(StaffRequiredMixin, ListView):
         return (
             User.objects
             .filter(is_staff=False)
-            .annotate(active_loan_count=Count('loans', filter=Q(loans__is_active=True)))
+            .annotate(current_loans=FilteredRelation('loans', condition=Q(loans__is_active=True)))
+            .annotate(active_loan_count=Count('current_loans'))
+            .prefetch_related(Prefetch(
+                'loans',
+                # member is the prefetch back-pointer and must stay loaded
+                queryset=(
+                    Loan.objects
+                    .filter(is_active=True)
+                    .select_related('book')
+                    .only('id', 'member', 'book__title')
+                ),
+                to_attr='active_loans',
+            ))
             .order_by('-date_joined')
         )
+
+
+class StaffUserSearchView(StaffRequiredMixin, View):
+
+    def get(self, request):
+        q = request.GET.get('q', '').strip()
+        members = (
+            User.objects
+            .filter(is_staff=False, is_active=True, username__istartswith=q)
+            .order_by('username')
+            .values('id', 'username')[:SEARCH_LIMIT]
+        )
+        results = [
+            {'id': member['id'], 'label': member['username']}
+            for member in members
+        ]
+        return JsonResponse({'results': results})
@@ -0,0 +1,34 @@
+// Fills a <datalist> for every input with data-autocomplete-url from the
+// staff search endpoints, so the option value is the id the form expects.
+(function () {
+    'use strict';
+
+    var DEBOUNCE_MS = 200;
+
+    document.querySelectorAll('input[data-autocomplete-url]').forEach(function (input) {
+        var datalist = document.createElement('datalist');
+        var timer = null;
+
+        datalist.id = input.id + '-options';
+        input.setAttribute('list', datalist.id);
+        input.insertAdjacentElement('afterend', datalist);
+
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                var url = input.dataset.autocompleteUrl + '?q=' + encodeURIComponent(input.value);
+                fetch(url, {credentials: 'same-origin'})
+                    .then(function (response) { return response.json(); })
+                    .then(function (data) {
+                        datalist.innerHTML = '';
+                        data.results.forEach(function (result) {
+                            var option = document.createElement('option');
+                            option.value = result.id;
+                            option.label = result.label;
+                            datalist.appendChild(option);
+                        });
+                    });
+            }, DEBOUNCE_MS);
+        });
+    });
+})();
@@ -1,48 +1,156 @@
+import copy
+
 import pytest
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import Client
 
 from library.models import Book, Genre, Loan
 
 
+@pytest.fixture(scope='session')
+def django_db_setup(django_db_setup, django_db_blocker):
+    """Seed the rows shared by the whole session once the test database exists.
+
+    Doing it here, rather than in the fixtures that return them, keeps the
+    inserts out of any one test's transaction even when a test pulls those
+    fixtures in lazily with ``request.getfixturevalue``.
+    """
+    with django_db_blocker.unblock():
+        Genre.objects.get_or_create(name='Fiction')
+
+
+@pytest.fixture(scope='session')
+def genre(django_db_setup, django_db_blocker):
+    """The single Genre seeded for the session. Tests only ever read it."""
+    with django_db_blocker.unblock():
+        return Genre.objects.get(name='Fiction')
+
+
+@pytest.fixture(scope='class')
+def class_db(django_db_setup, django_db_blocker):
+    """A transaction spanning one test class, rolled back when it ends.
+
+    Rows created by the class-scoped fixtures below live in it; each test's
+    own ``db`` transaction then nests inside as a savepoint, so whatever a
+    test changes is undone before the next one. Those fixtures must be
+    requested in the test signature, not through ``getfixturevalue``, or
+    they would be created inside the first test's savepoint instead.
+    """
+    with django_db_blocker.unblock():
+        atomic = transaction.atomic()
+        atomic.__enter__()
+    yield
+    with django_db_blocker.unblock():
+        transaction.set_rollback(True)
+        atomic.__exit__(None, None, None)
+
+
+@pytest.fixture(scope='class')
+def _class_member_user(class_db, django_db_blocker):
+    with django_db_blocker.unblock():
+        return User.objects.create_user(
+            username='member',
+            email='member@example.com',
+            password='testpass123',
+        )
+
+
+@pytest.fixture(scope='class')
+def _class_staff_user(class_db, django_db_blocker):
+    with django_db_blocker.unblock():
+        return User.objects.create_user(
+            username='staffuser',
+            email='staff@example.com',
+            password='staffpass123',
+            is_staff=True,
+        )
+
+
+@pytest.fixture(scope='class')
+def _class_other_user(class_db, django_db_blocker):
+    with django_db_blocker.unblock():
+        user = User(username='other')
+        user.set_unusable_password()
+        user.save()
+        return user
+
+
+@pytest.fixture(scope='class')
+def _class_book(class_db, django_db_blocker, genre):
+    with django_db_blocker.unblock():
+        b = Book.objects.create(
+            title='Test Book',
+            author='Test Author',
+            isbn='9781234567890',
+            total_copies=3,
+            available_copies=3,
+        )
+        b.genres.add(genre)
+        return b
+
+
+@pytest.fixture(scope='class')
+def _class_staff_client(_class_staff_user, django_db_blocker):
+    client = Client()
+    with django_db_blocker.unblock():
+        client.force_login(_class_staff_user)
+    return client
+
+
 @pytest.fixture
-def member_user(db):
+def member_user(db, _class_member_user):
     """A regular (non-staff) authenticated user."""
-    return User.objects.create_user(
-        username='member',
-        email='member@example.com',
-        password='testpass123',
-    )
+    return copy.deepcopy(_class_member_user)
 
 
 @pytest.fixture
-def staff_user(db):
+def staff_user(db, _class_staff_user):
     """A staff user with management privileges."""
-    return User.objects.create_user(
-        username='staffuser',
-        email='staff@example.com',
-        password='staffpass123',
-        is_staff=True,
-    )
+    return copy.deepcopy(_class_staff_user)
 
 
 @pytest.fixture
-def genre(db):
-    """A single Genre instance."""
-    return Genre.objects.create(name='Fiction')
+def other_user(db, _class_other_user):
+    """A second regular user, for cross-user checks. Log in with force_login."""
+    return copy.deepcopy(_class_other_user)
 
 
 @pytest.fixture
-def book(db, genre):
+def staff_client(db, _class_staff_client):
+    """A Client logged in as staff_user, shared by every test in a class.
+
+    The session is created once with the class rows; any other cookie a
+    test picks up (e.g. queued messages) is dropped before the next test.
+    """
+    for key in list(_class_staff_client.cookies):
+        if key != settings.SESSION_COOKIE_NAME:
+            del _class_staff_client.cookies[key]
+    return _class_staff_client
+
+
+@pytest.fixture
+def book(db, _class_book):
     """A Book with 3 total / 3 available copies and one genre."""
-    b = Book.objects.create(
-        title='Test Book',
-        author='Test Author',
-        isbn='9781234567890',
-        total_copies=3,
-        available_copies=3,
-    )
-    b.genres.add(genre)
-    return b
+    return copy.deepcopy(_class_book)
+
+
+@pytest.fixture
+def books_bulk(request, db, genre):
+    """A batch of single-copy Books in the shared genre, 100 by default.
+
+    Inserted with bulk_create so list-size tests stay cheap; pass a
+    different count with indirect parametrisation.
+    """
+    count = getattr(request, 'param', 100)
+    books = Book.objects.bulk_create([
+        Book(title=f'Bulk Book {i}', author='Bulk Author', isbn=f'978{i:010d}', total_copies=1, available_copies=1)
+        for i in range(count)
+    ])
+    through = Book.genres.through
+    through.objects.bulk_create([through(book_id=b.pk, genre_id=genre.pk) for b in books])
+    return books
 
 
 @pytest.fixture
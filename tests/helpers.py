@@ -0,0 +1,45 @@
+"""
+Assertion helpers shared across the test modules.
+"""
+
+from functools import lru_cache
+
+from django.db.models import Count, Q
+from django.urls import reverse
+
+from library.models import Book
+
+
+@lru_cache(maxsize=None)
+def lib_url(name, pk=None):
+    """Reverse a ``library:`` route, memoised since the URLconf never
+    changes during a run."""
+    if pk is None:
+        return reverse(f'library:{name}')
+    return reverse(f'library:{name}', kwargs={'pk': pk})
+
+
+def assert_exactly_one(queryset, pk=None):
+    """Assert that ``queryset`` matches exactly one row (``pk``, if given).
+
+    Fetches at most two primary keys, so the check stays an index probe
+    rather than a full COUNT(*).
+    """
+    pks = list(queryset.values_list('pk', flat=True)[:2])
+    assert len(pks) == 1, f'expected exactly one row, got {pks}'
+    if pk is not None:
+        assert pks == [pk]
+
+
+def assert_book_state(pk, exists, active_loans=0):
+    """Assert whether Book ``pk`` exists and how many active loans it has,
+    reading both in one aggregated query."""
+    row = (
+        Book.objects.filter(pk=pk)
+        .annotate(active_loans=Count('loans', filter=Q(loans__is_active=True)))
+        .values('active_loans')
+        .first()
+    )
+    assert (row is not None) is exists
+    if exists:
+        assert row['active_loans'] == active_loans
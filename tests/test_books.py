@@ -3,7 +3,10 @@ Tests for book-related views: list and detail.
 """
 
 import pytest
-from django.urls import reverse
+
+from library.models import Book
+
+from .helpers import lib_url
 
 
 @pytest.mark.django_db
@@ -14,15 +17,39 @@ class TestBookList:
         """An authenticated user can access the book list and see
         the book title in the response."""
         client.force_login(member_user)
-        url = reverse('library:book_list')
+        url = lib_url('book_list')
         response = client.get(url)
 
         assert response.status_code == 200
         assert book.title.encode() in response.content
 
+    def test_book_list_badges_borrowed_books(self, client, member_user, other_user, book, active_loan):
+        """Books the member has checked out are badged, and only for
+        that member."""
+        client.force_login(member_user)
+        url = lib_url('book_list')
+        assert b'Checked Out' in client.get(url).content
+
+        client.force_login(other_user)
+        assert b'Checked Out' not in client.get(url).content
+
+    @pytest.mark.parametrize('books_bulk', [1, 10, 100], indirect=True)
+    def test_book_list_query_count_is_constant(
+        self, client, member_user, books_bulk, django_assert_num_queries
+    ):
+        """The catalogue costs the same queries however many books there
+        are: session, user, and the books with their loan badges."""
+        client.force_login(member_user)
+        url = lib_url('book_list')
+
+        with django_assert_num_queries(3):
+            response = client.get(url)
+
+        assert response.status_code == 200
+
     def test_book_list_requires_login(self, client):
         """An unauthenticated user is redirected to the login page."""
-        url = reverse('library:book_list')
+        url = lib_url('book_list')
         response = client.get(url)
 
         assert response.status_code == 302
@@ -37,7 +64,7 @@ class TestBookDetail:
         """An authenticated user can view a book's detail page with
         correct context (can_checkout=True when no active loan)."""
         client.force_login(member_user)
-        url = reverse('library:book_detail', kwargs={'pk': book.pk})
+        url = lib_url('book_detail', book.pk)
         response = client.get(url)
 
         assert response.status_code == 200
@@ -51,7 +78,7 @@ class TestBookDetail:
         """When the user already has an active loan for this book,
         can_checkout is False and has_active_loan is True."""
         client.force_login(member_user)
-        url = reverse('library:book_detail', kwargs={'pk': book.pk})
+        url = lib_url('book_detail', book.pk)
         response = client.get(url)
 
         assert response.status_code == 200
@@ -62,11 +89,10 @@ class TestBookDetail:
         self, client, member_user, book
     ):
         """When a book has no available copies, can_checkout is False."""
-        book.available_copies = 0
-        book.save(update_fields=['available_copies'])
+        Book.objects.filter(pk=book.pk).update(available_copies=0)
 
         client.force_login(member_user)
-        url = reverse('library:book_detail', kwargs={'pk': book.pk})
+        url = lib_url('book_detail', book.pk)
         response = client.get(url)
 
         assert response.status_code == 200
@@ -75,7 +101,7 @@ class TestBookDetail:
     def test_book_detail_nonexistent_returns_404(self, client, member_user):
         """Requesting a non-existent book returns 404."""
         client.force_login(member_user)
-        url = reverse('library:book_detail', kwargs={'pk': 99999})
+        url = lib_url('book_detail', 99999)
         response = client.get(url)
 
         assert response.status_code == 404
@@ -0,0 +1,29 @@
+"""
+Tests for the management commands.
+"""
+
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.db.models import Count
+
+from library.models import Book
+
+
+@pytest.mark.django_db
+class TestPopulateBooks:
+    """Tests for the populate_books command."""
+
+    def test_populate_books_is_idempotent(self):
+        """A second run skips every book and adds no duplicate books or
+        genre links."""
+        call_command('populate_books', stdout=StringIO())
+        out = StringIO()
+        call_command('populate_books', stdout=out)
+
+        assert '0 book(s) created, 20 skipped' in out.getvalue()
+
+        assert Book.objects.count() == 20
+        assert Book.genres.through.objects.count() == 44
+        assert not Book.objects.values('isbn').annotate(n=Count('pk')).filter(n__gt=1).exists()
@@ -5,7 +5,7 @@ Tests for form validation: BookForm and AssignLoanForm.
 import pytest
 
 from library.forms import AssignLoanForm, BookForm
-from library.models import Genre  # noqa: F401 — used by fixtures indirectly
+from library.models import Book, Genre
 
 
 @pytest.mark.django_db
@@ -52,6 +52,31 @@ class TestBookForm:
         form = BookForm(data=data)
         assert form.is_valid()
 
+    def test_rejects_available_copies_that_leave_no_room_for_loans(self, genre, book, active_loan):
+        """Editing a book must keep one unavailable copy per active loan."""
+        data = {
+            'title': book.title,
+            'author': book.author,
+            'isbn': book.isbn,
+            'total_copies': 3,
+            'available_copies': 3,
+            'genres': [genre.pk],
+        }
+        assert not BookForm(data=data, instance=book).is_valid()
+
+        data['available_copies'] = 2
+        assert BookForm(data=data, instance=book).is_valid()
+
+    def test_genre_choices_follow_genre_changes(self, genre):
+        """The genre checkboxes pick up newly added genres."""
+        assert list(BookForm().fields['genres'].choices) == [(genre.pk, 'Fiction')]
+
+        mystery = Genre.objects.create(name='Mystery')
+        assert list(BookForm().fields['genres'].choices) == [
+            (genre.pk, 'Fiction'),
+            (mystery.pk, 'Mystery'),
+        ]
+
 
 @pytest.mark.django_db
 class TestAssignLoanForm:
@@ -71,8 +96,7 @@ class TestAssignLoanForm:
     def test_rejects_book_with_zero_availability(self, member_user, book):
         """AssignLoanForm.clean() rejects assignment when no copies
         are available."""
-        book.available_copies = 0
-        book.save(update_fields=['available_copies'])
+        Book.objects.filter(pk=book.pk).update(available_copies=0)
 
         data = {
             'member': member_user.pk,
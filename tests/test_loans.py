@@ -3,10 +3,17 @@ Tests for loan business logic: checkout, return, duplicate prevention,
 zero-availability rejection, and the my-loans view.
 """
 
+from datetime import datetime, timezone
+
 import pytest
-from django.urls import reverse
+from django.contrib.messages import get_messages
+from django.db import IntegrityError, transaction
+
+from library.models import Book, Loan
 
-from library.models import Loan
+from .helpers import assert_exactly_one, lib_url
+
+_RETURN_TS = datetime(2025, 1, 1, tzinfo=timezone.utc)
 
 
 @pytest.mark.django_db
@@ -17,41 +24,55 @@ class TestCheckout:
         """A POST to the checkout endpoint creates an active Loan and
         decrements the book's available_copies by 1."""
         client.force_login(member_user)
-        url = reverse('library:book_checkout', kwargs={'pk': book.pk})
+        url = lib_url('book_checkout', book.pk)
         response = client.post(url)
 
         assert response.status_code == 302
+        assert [str(m) for m in get_messages(response.wsgi_request)] == [
+            f'You have checked out "{book.title}".'
+        ]
 
-        # Verify the loan was created
-        loan = Loan.objects.get(member=member_user, book=book)
+        # Verify the loan was created and available copies decremented
+        loan = Loan.objects.select_related('book').get(member=member_user, book=book)
         assert loan.is_active is True
-
-        # Verify available copies decremented
-        book.refresh_from_db()
-        assert book.available_copies == 2  # was 3, now 2
+        assert loan.book.available_copies == 2  # was 3, now 2
 
     def test_checkout_duplicate_loan_rejected(self, client, member_user, book, active_loan):
         """A user who already has an active loan for a book cannot
         check it out again."""
         client.force_login(member_user)
-        url = reverse('library:book_checkout', kwargs={'pk': book.pk})
+        url = lib_url('book_checkout', book.pk)
         response = client.post(url)
 
         assert response.status_code == 302
         # Only the original loan should exist
-        assert Loan.objects.filter(
-            member=member_user, book=book, is_active=True
-        ).count() == 1
+        assert_exactly_one(
+            Loan.objects.filter(member=member_user, book=book, is_active=True),
+            pk=active_loan.pk,
+        )
+
+        # The rejected checkout must not consume a copy
+        book.refresh_from_db()
+        assert book.available_copies == 2
+
+    def test_database_rejects_second_active_loan(self, member_user, book, active_loan):
+        """The partial unique constraint, not a pre-check, is what stops
+        a duplicate active loan, so concurrent checkouts cannot race past it."""
+        with pytest.raises(IntegrityError), transaction.atomic():
+            Loan.objects.create(member=member_user, book=book)
+
+        # a returned loan does not count against the constraint
+        Loan.objects.filter(pk=active_loan.pk).update(is_active=False)
+        Loan.objects.create(member=member_user, book=book)
 
     def test_checkout_rejected_when_no_copies_available(
         self, client, member_user, book
     ):
         """Checkout is rejected when the book has zero available copies."""
-        book.available_copies = 0
-        book.save(update_fields=['available_copies'])
+        Book.objects.filter(pk=book.pk).update(available_copies=0)
 
         client.force_login(member_user)
-        url = reverse('library:book_checkout', kwargs={'pk': book.pk})
+        url = lib_url('book_checkout', book.pk)
         response = client.post(url)
 
         assert response.status_code == 302
@@ -60,7 +81,7 @@ class TestCheckout:
     def test_checkout_nonexistent_book_returns_404(self, client, member_user):
         """Checking out a non-existent book returns 404."""
         client.force_login(member_user)
-        url = reverse('library:book_checkout', kwargs={'pk': 99999})
+        url = lib_url('book_checkout', 99999)
         response = client.post(url)
 
         assert response.status_code == 404
@@ -76,25 +97,62 @@ class TestReturn:
         """A POST to the return endpoint sets the loan to inactive,
         records returned_at, and increments available_copies."""
         client.force_login(member_user)
-        url = reverse('library:loan_return', kwargs={'pk': active_loan.pk})
+        url = lib_url('loan_return', active_loan.pk)
         response = client.post(url)
 
         assert response.status_code == 302
 
-        # Verify the loan is now inactive
-        active_loan.refresh_from_db()
-        assert active_loan.is_active is False
-        assert active_loan.returned_at is not None
-
-        # Verify available copies incremented back
-        book.refresh_from_db()
+        # Verify the loan is now inactive and available copies incremented back
+        loan = Loan.objects.select_related('book').get(pk=active_loan.pk)
+        assert loan.is_active is False
+        assert loan.returned_at is not None
         # Started at 3, active_loan fixture decremented to 2, return brings it back to 3
-        assert book.available_copies == 3
+        assert loan.book.available_copies == 3
+
+    def test_edit_to_full_then_return(
+        self, client, staff_user, member_user, book, genre, active_loan
+    ):
+        """Staff cannot mark every copy available while one is on loan, so
+        the member's return still has room for the copy."""
+        client.force_login(staff_user)
+        response = client.post(lib_url('staff_book_edit', book.pk), {
+            'title': book.title,
+            'author': book.author,
+            'isbn': book.isbn,
+            'total_copies': 3,
+            'available_copies': 3,
+            'genres': [genre.pk],
+        })
+        assert response.status_code == 200
+        assert '1 copy is on loan, so available copies cannot exceed 2.' in str(response.context['form'].errors)
+
+        client.force_login(member_user)
+        response = client.post(lib_url('loan_return', active_loan.pk))
+
+        assert response.status_code == 302
+        loan = Loan.objects.select_related('book').get(pk=active_loan.pk)
+        assert loan.is_active is False
+        assert loan.book.available_copies == 3
+
+    def test_return_blocked_by_copy_counts_is_reported(
+        self, client, member_user, book, active_loan
+    ):
+        """If the counts already leave no room for the copy (e.g. edited
+        before the form check existed), the return fails with a message
+        rather than a server error, and the loan stays open."""
+        Book.objects.filter(pk=book.pk).update(available_copies=3)
+        client.force_login(member_user)
+        response = client.post(lib_url('loan_return', active_loan.pk))
+
+        assert response.status_code == 302
+        assert 'could not be returned' in str(list(get_messages(response.wsgi_request))[0])
+        active_loan.refresh_from_db()
+        assert active_loan.is_active is True
 
     def test_return_nonexistent_loan_returns_404(self, client, member_user):
         """Returning a non-existent loan returns 404."""
         client.force_login(member_user)
-        url = reverse('library:loan_return', kwargs={'pk': 99999})
+        url = lib_url('loan_return', 99999)
         response = client.post(url)
 
         assert response.status_code == 404
@@ -109,15 +167,13 @@ class TestMyLoans:
     ):
         """The my-loans page separates active loans from past loans."""
         # Return the active loan to create a past loan
-        active_loan.is_active = False
-        active_loan.returned_at = '2025-01-01T00:00:00Z'
-        active_loan.save(update_fields=['is_active', 'returned_at'])
+        Loan.objects.filter(pk=active_loan.pk).update(is_active=False, returned_at=_RETURN_TS)
 
         # Create a new active loan
-        Loan.objects.create(member=member_user, book=book)
+        Loan.objects.bulk_create([Loan(member=member_user, book=book)])
 
         client.force_login(member_user)
-        url = reverse('library:my_loans')
+        url = lib_url('my_loans')
         response = client.get(url)
 
         assert response.status_code == 200
@@ -127,7 +183,7 @@ class TestMyLoans:
     def test_my_loans_empty_for_new_user(self, client, member_user):
         """A user with no loans sees empty lists."""
         client.force_login(member_user)
-        url = reverse('library:my_loans')
+        url = lib_url('my_loans')
         response = client.get(url)
 
         assert response.status_code == 200
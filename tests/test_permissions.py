@@ -4,8 +4,33 @@ anonymous access denial, and cross-user isolation.
 """
 
 import pytest
-from django.contrib.auth.models import User
-from django.urls import reverse
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import PermissionDenied
+from django.urls import resolve
+
+from .helpers import lib_url
+
+BOOK_LIST_URL = lib_url('book_list')
+MY_LOANS_URL = lib_url('my_loans')
+STAFF_BOOK_LIST_URL = lib_url('staff_book_list')
+STAFF_BOOK_ADD_URL = lib_url('staff_book_add')
+STAFF_LOAN_LIST_URL = lib_url('staff_loan_list')
+STAFF_LOAN_ASSIGN_URL = lib_url('staff_loan_assign')
+
+
+def _url(request, name, pk_from):
+    """URL for ``name``, taking its pk from the ``pk_from`` fixture if given."""
+    return lib_url(name, request.getfixturevalue(pk_from).pk if pk_from else None)
+
+
+def _call_view(req):
+    """Call the view behind ``req.path`` directly, skipping the middleware.
+
+    Only for checks that happen before the view touches the session,
+    messages or CSRF: ``req.user`` must be set by the caller.
+    """
+    match = resolve(req.path)
+    return match.func(req, *match.args, **match.kwargs)
 
 
 # ---------------------------------------------------------------------------
@@ -16,64 +41,32 @@ from django.urls import reverse
 class TestStaffRestriction:
     """Non-staff users must receive 403 on every staff-only view."""
 
-    def test_non_staff_blocked_from_staff_book_list(self, client, member_user):
-        client.force_login(member_user)
-        url = reverse('library:staff_book_list')
-        response = client.get(url)
-        assert response.status_code == 403
-
-    def test_non_staff_blocked_from_staff_book_add(self, client, member_user):
-        client.force_login(member_user)
-        url = reverse('library:staff_book_add')
-        response = client.get(url)
-        assert response.status_code == 403
-
-    def test_non_staff_blocked_from_staff_book_edit(self, client, member_user, book):
-        client.force_login(member_user)
-        url = reverse('library:staff_book_edit', kwargs={'pk': book.pk})
-        response = client.get(url)
-        assert response.status_code == 403
-
-    def test_non_staff_blocked_from_staff_book_delete(self, client, member_user, book):
-        client.force_login(member_user)
-        url = reverse('library:staff_book_delete', kwargs={'pk': book.pk})
-        response = client.get(url)
-        assert response.status_code == 403
-
-    def test_non_staff_blocked_from_staff_loan_list(self, client, member_user):
-        client.force_login(member_user)
-        url = reverse('library:staff_loan_list')
-        response = client.get(url)
-        assert response.status_code == 403
-
-    def test_non_staff_blocked_from_staff_loan_assign(self, client, member_user):
-        client.force_login(member_user)
-        url = reverse('library:staff_loan_assign')
-        response = client.get(url)
-        assert response.status_code == 403
-
-    def test_non_staff_blocked_from_staff_force_return(
-        self, client, member_user, active_loan
-    ):
-        client.force_login(member_user)
-        url = reverse(
-            'library:staff_loan_force_return', kwargs={'pk': active_loan.pk}
-        )
-        response = client.post(url)
-        assert response.status_code == 403
+    @pytest.mark.parametrize('method,name,pk_from', [
+        ('get', 'staff_book_list', None),
+        ('get', 'staff_book_add', None),
+        ('get', 'staff_book_edit', 'book'),
+        ('get', 'staff_book_delete', 'book'),
+        ('get', 'staff_loan_list', None),
+        ('get', 'staff_loan_assign', None),
+        ('post', 'staff_loan_force_return', 'active_loan'),
+    ])
+    def test_non_staff_blocked(self, request, rf, member_user, book, method, name, pk_from):
+        """The view raises PermissionDenied, which Django serves as a 403."""
+        req = getattr(rf, method)(_url(request, name, pk_from))
+        req.user = member_user
+        with pytest.raises(PermissionDenied):
+            _call_view(req)
 
     # -- Positive: staff CAN access --
 
-    def test_staff_can_access_staff_book_list(self, client, staff_user, book):
-        client.force_login(staff_user)
-        url = reverse('library:staff_book_list')
-        response = client.get(url)
+    def test_staff_can_access_staff_book_list(self, staff_client, book):
+        url = STAFF_BOOK_LIST_URL
+        response = staff_client.get(url)
         assert response.status_code == 200
 
-    def test_staff_can_access_staff_loan_list(self, client, staff_user):
-        client.force_login(staff_user)
-        url = reverse('library:staff_loan_list')
-        response = client.get(url)
+    def test_staff_can_access_staff_loan_list(self, staff_client):
+        url = STAFF_LOAN_LIST_URL
+        response = staff_client.get(url)
         assert response.status_code == 200
 
 
@@ -81,44 +74,26 @@ class TestStaffRestriction:
 # Anonymous (unauthenticated) access denial
 # ---------------------------------------------------------------------------
 
-@pytest.mark.django_db
 class TestAnonymousAccessDenied:
     """Unauthenticated users must be redirected to login for all
-    protected endpoints."""
-
-    def test_anonymous_redirected_from_book_list(self, client):
-        url = reverse('library:book_list')
-        response = client.get(url)
-        assert response.status_code == 302
-        assert '/login/' in response.url
-
-    def test_anonymous_redirected_from_checkout(self, client, book):
-        url = reverse('library:book_checkout', kwargs={'pk': book.pk})
-        response = client.post(url)
-        assert response.status_code == 302
-        assert '/login/' in response.url
-
-    def test_anonymous_redirected_from_loan_return(self, client, active_loan):
-        url = reverse('library:loan_return', kwargs={'pk': active_loan.pk})
-        response = client.post(url)
-        assert response.status_code == 302
-        assert '/login/' in response.url
-
-    def test_anonymous_redirected_from_my_loans(self, client):
-        url = reverse('library:my_loans')
-        response = client.get(url)
-        assert response.status_code == 302
-        assert '/login/' in response.url
-
-    def test_anonymous_redirected_from_staff_book_list(self, client):
-        url = reverse('library:staff_book_list')
-        response = client.get(url)
-        assert response.status_code == 302
-        assert '/login/' in response.url
-
-    def test_anonymous_redirected_from_staff_loan_list(self, client):
-        url = reverse('library:staff_loan_list')
-        response = client.get(url)
+    protected endpoints.
+
+    The login check runs before any lookup, so a placeholder pk is enough
+    and these tests need no database.
+    """
+
+    @pytest.mark.parametrize('method,url', [
+        ('get', BOOK_LIST_URL),
+        ('post', lib_url('book_checkout', 1)),
+        ('post', lib_url('loan_return', 1)),
+        ('get', MY_LOANS_URL),
+        ('get', STAFF_BOOK_LIST_URL),
+        ('get', STAFF_LOAN_LIST_URL),
+    ])
+    def test_anonymous_redirected(self, rf, method, url):
+        req = getattr(rf, method)(url)
+        req.user = AnonymousUser()
+        response = _call_view(req)
         assert response.status_code == 302
         assert '/login/' in response.url
 
@@ -127,28 +102,22 @@ class TestAnonymousAccessDenied:
 # POST-only enforcement
 # ---------------------------------------------------------------------------
 
-@pytest.mark.django_db
 class TestPostOnlyViews:
-    """State-changing views must reject GET requests."""
-
-    def test_checkout_rejects_get(self, client, member_user, book):
-        client.force_login(member_user)
-        url = reverse('library:book_checkout', kwargs={'pk': book.pk})
-        response = client.get(url)
-        assert response.status_code == 405
-
-    def test_return_rejects_get(self, client, member_user, active_loan):
-        client.force_login(member_user)
-        url = reverse('library:loan_return', kwargs={'pk': active_loan.pk})
-        response = client.get(url)
-        assert response.status_code == 405
-
-    def test_force_return_rejects_get(self, client, staff_user, active_loan):
-        client.force_login(staff_user)
-        url = reverse(
-            'library:staff_loan_force_return', kwargs={'pk': active_loan.pk}
-        )
-        response = client.get(url)
+    """State-changing views must reject GET requests.
+
+    The method check runs before any lookup, so an unsaved user and a
+    placeholder pk are enough and these tests need no database.
+    """
+
+    @pytest.mark.parametrize('is_staff,name', [
+        (False, 'book_checkout'),
+        (False, 'loan_return'),
+        (True, 'staff_loan_force_return'),
+    ])
+    def test_rejects_get(self, rf, is_staff, name):
+        req = rf.get(lib_url(name, 1))
+        req.user = User(username='member', is_staff=is_staff)
+        response = _call_view(req)
         assert response.status_code == 405
 
 
@@ -161,15 +130,12 @@ class TestCrossUserIsolation:
     """A member must not be able to return another member's loan."""
 
     def test_member_cannot_return_other_users_loan(
-        self, client, book, active_loan
+        self, client, other_user, book, active_loan
     ):
         """active_loan belongs to member_user. A different user should get
         404 when trying to return it (the queryset scopes by request.user)."""
-        other_user = User.objects.create_user(
-            username='other', password='otherpass123'
-        )
         client.force_login(other_user)
-        url = reverse('library:loan_return', kwargs={'pk': active_loan.pk})
+        url = lib_url('loan_return', active_loan.pk)
         response = client.post(url)
         assert response.status_code == 404
 
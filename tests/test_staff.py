@@ -4,19 +4,28 @@ force return, and loan list filtering.
 """
 
 import pytest
-from django.urls import reverse
+from django.contrib import messages
+from django.contrib.messages import get_messages
+from django.db import connection
 
+from library import pagination
 from library.models import Book, Loan
+from library.pagination import EstimatedCountPaginator
+
+from .helpers import assert_book_state, assert_exactly_one, lib_url
+
+# session, user, the count and the page; unfiltered lists also read the
+# pg_class estimate first
+LOAN_LIST_QUERIES = 4
 
 
 @pytest.mark.django_db
 class TestStaffBookCRUD:
     """Tests for staff book create, update, and delete operations."""
 
-    def test_staff_create_book(self, client, staff_user, genre):
+    def test_staff_create_book(self, staff_client, genre):
         """Staff can create a new book via POST to the add endpoint."""
-        client.force_login(staff_user)
-        url = reverse('library:staff_book_add')
+        url = lib_url('staff_book_add')
         data = {
             'title': 'New Book',
             'author': 'New Author',
@@ -25,7 +34,7 @@ class TestStaffBookCRUD:
             'available_copies': 5,
             'genres': [genre.pk],
         }
-        response = client.post(url, data)
+        response = staff_client.post(url, data)
 
         assert response.status_code == 302
         assert Book.objects.filter(title='New Book').exists()
@@ -33,59 +42,55 @@ class TestStaffBookCRUD:
         assert book.author == 'New Author'
         assert book.total_copies == 5
 
-    def test_staff_update_book(self, client, staff_user, book):
+    def test_staff_update_book(self, staff_client, book, genre):
         """Staff can update an existing book's fields."""
-        client.force_login(staff_user)
-        url = reverse('library:staff_book_edit', kwargs={'pk': book.pk})
+        url = lib_url('staff_book_edit', book.pk)
         data = {
             'title': 'Updated Title',
             'author': book.author,
             'isbn': book.isbn,
             'total_copies': book.total_copies,
             'available_copies': book.available_copies,
-            'genres': list(book.genres.values_list('pk', flat=True)),
+            'genres': [genre.pk],
         }
-        response = client.post(url, data)
+        response = staff_client.post(url, data)
 
         assert response.status_code == 302
         book.refresh_from_db()
         assert book.title == 'Updated Title'
 
-    def test_staff_delete_book(self, client, staff_user, book):
+    def test_staff_delete_book(self, staff_client, book):
         """Staff can delete a book with no active loans."""
-        client.force_login(staff_user)
-        url = reverse('library:staff_book_delete', kwargs={'pk': book.pk})
-        response = client.post(url)
+        url = lib_url('staff_book_delete', book.pk)
+        response = staff_client.post(url)
 
         assert response.status_code == 302
-        assert not Book.objects.filter(pk=book.pk).exists()
+        assert_book_state(book.pk, exists=False)
 
     def test_staff_delete_book_blocked_by_active_loans(
-        self, client, staff_user, book, active_loan
+        self, staff_client, book, active_loan
     ):
         """Staff cannot delete a book that has active loans."""
-        client.force_login(staff_user)
-        url = reverse('library:staff_book_delete', kwargs={'pk': book.pk})
-        response = client.post(url)
+        url = lib_url('staff_book_delete', book.pk)
+        response = staff_client.post(url)
 
         assert response.status_code == 302
-        # Book must still exist
-        assert Book.objects.filter(pk=book.pk).exists()
+        # Book must still exist, loan untouched
+        assert_book_state(book.pk, exists=True, active_loans=1)
 
 
 @pytest.mark.django_db
 class TestStaffLoanAssign:
     """Tests for staff loan assignment."""
 
-    def test_staff_loan_assign_creates_loan(self, client, staff_user, member_user, book):
+    def test_staff_loan_assign_creates_loan(self, staff_client, member_user, book):
         """Staff can assign a loan on behalf of a member."""
-        client.force_login(staff_user)
-        url = reverse('library:staff_loan_assign')
+        url = lib_url('staff_loan_assign')
         data = {
             'member': member_user.pk,
             'book': book.pk,
         }
-        response = client.post(url, data)
+        response = staff_client.post(url, data)
 
         assert response.status_code == 302
         assert Loan.objects.filter(
@@ -95,22 +100,72 @@ class TestStaffLoanAssign:
         assert book.available_copies == 2  # was 3, now 2
 
     def test_staff_loan_assign_duplicate_rejected(
-        self, client, staff_user, member_user, book, active_loan
+        self, staff_client, member_user, book, active_loan
     ):
         """Staff cannot assign a duplicate active loan for the same
         member and book combination."""
-        client.force_login(staff_user)
-        url = reverse('library:staff_loan_assign')
+        url = lib_url('staff_loan_assign')
         data = {
             'member': member_user.pk,
             'book': book.pk,
         }
-        client.post(url, data)
+        staff_client.post(url, data)
 
         # The form-level clean() should catch this and re-render or redirect
-        assert Loan.objects.filter(
-            member=member_user, book=book, is_active=True
-        ).count() == 1
+        assert_exactly_one(
+            Loan.objects.filter(member=member_user, book=book, is_active=True),
+            pk=active_loan.pk,
+        )
+
+
+@pytest.mark.django_db
+class TestStaffBookList:
+    """Tests for the streamed staff book table."""
+
+    def test_book_list_streams_rows(self, staff_client, book, genre):
+        """Every book is streamed as a table row between the page
+        header and footer."""
+        url = lib_url('staff_book_list')
+        response = staff_client.get(url)
+
+        assert response.status_code == 200
+        assert response.streaming
+        content = b''.join(response.streaming_content).decode()
+        assert content.index('<tbody>') < content.index(book.title) < content.index('</tbody>')
+        assert genre.name in content
+        assert 'No books in the catalogue.' not in content
+
+    def test_book_list_empty_state(self, staff_client):
+        """With no books the table shows the empty-state row."""
+        # the class-scoped book outlives the test that first requested it
+        Book.objects.all().delete()
+        response = staff_client.get(lib_url('staff_book_list'))
+
+        content = b''.join(response.streaming_content).decode()
+        assert 'No books in the catalogue.' in content
+
+
+@pytest.mark.django_db
+class TestStaffSearch:
+    """Tests for the autocomplete endpoints behind the assign-loan form."""
+
+    def test_user_search_matches_username_prefix(self, staff_client, member_user):
+        """Only non-staff members whose username starts with q are returned."""
+        url = lib_url('staff_user_search')
+        response = staff_client.get(url, {'q': 'mem'})
+
+        assert response.status_code == 200
+        assert response.json() == {
+            'results': [{'id': member_user.pk, 'label': 'member'}],
+        }
+
+    def test_book_search_excludes_unavailable_books(self, staff_client, book):
+        """Books with no available copies are not offered."""
+        url = lib_url('staff_book_search')
+        assert len(staff_client.get(url, {'q': 'Test'}).json()['results']) == 1
+
+        Book.objects.filter(pk=book.pk).update(available_copies=0)
+        assert staff_client.get(url, {'q': 'Test'}).json()['results'] == []
 
 
 @pytest.mark.django_db
@@ -118,75 +173,222 @@ class TestStaffForceReturn:
     """Tests for staff force-return functionality."""
 
     def test_staff_force_return_deactivates_loan(
-        self, client, staff_user, book, active_loan
+        self, staff_client, book, active_loan
     ):
         """Staff force-return sets the loan inactive and increments
         available_copies."""
-        client.force_login(staff_user)
-        url = reverse(
-            'library:staff_loan_force_return', kwargs={'pk': active_loan.pk}
-        )
-        response = client.post(url)
+        url = lib_url('staff_loan_force_return', active_loan.pk)
+        response = staff_client.post(url)
 
         assert response.status_code == 302
 
-        active_loan.refresh_from_db()
-        assert active_loan.is_active is False
-        assert active_loan.returned_at is not None
-
-        book.refresh_from_db()
+        loan = Loan.objects.select_related('book').get(pk=active_loan.pk)
+        assert loan.is_active is False
+        assert loan.returned_at is not None
         # active_loan fixture decremented from 3 to 2; force-return restores to 3
-        assert book.available_copies == 3
+        assert loan.book.available_copies == 3
+
+    def test_staff_force_return_blocked_by_copy_counts(
+        self, staff_client, book, active_loan
+    ):
+        """A book with no room for the copy gets a message, not a 500."""
+        Book.objects.filter(pk=book.pk).update(available_copies=3)
+        response = staff_client.post(lib_url('staff_loan_force_return', active_loan.pk))
+
+        assert response.status_code == 302
+        active_loan.refresh_from_db()
+        assert active_loan.is_active is True
 
     def test_staff_force_return_nonexistent_loan_returns_404(
-        self, client, staff_user
+        self, staff_client
     ):
         """Force-returning a non-existent loan yields 404."""
-        client.force_login(staff_user)
-        url = reverse(
-            'library:staff_loan_force_return', kwargs={'pk': 99999}
-        )
-        response = client.post(url)
+        url = lib_url('staff_loan_force_return', 99999)
+        response = staff_client.post(url)
         assert response.status_code == 404
 
 
+@pytest.mark.django_db
+class TestStaffBulkForceReturn:
+    """Tests for returning several loans in one request."""
+
+    def test_bulk_force_return_restores_copies_per_book(
+        self, staff_client, member_user, book, active_loan
+    ):
+        """Every selected loan is closed and each book gets back one copy
+        per returned loan."""
+        other_book = Book.objects.create(
+            title='Other Book', author='Other Author', total_copies=2, available_copies=1,
+        )
+        other_loan = Loan.objects.create(member=member_user, book=other_book)
+
+        url = lib_url('staff_loan_bulk_force_return')
+        response = staff_client.post(url, {'loan_ids': [active_loan.pk, other_loan.pk]})
+
+        assert response.status_code == 302
+        assert not Loan.objects.filter(is_active=True).exists()
+        book.refresh_from_db()
+        other_book.refresh_from_db()
+        assert book.available_copies == 3
+        assert other_book.available_copies == 2
+
+    def test_bulk_force_return_ignores_returned_loans(
+        self, staff_client, book, active_loan
+    ):
+        """Loans that are already returned do not add copies again, and the
+        repeat request is reported as an error rather than a success."""
+        url = lib_url('staff_loan_bulk_force_return')
+        staff_client.post(url, {'loan_ids': [active_loan.pk]})
+        response = staff_client.post(url, {'loan_ids': [active_loan.pk]})
+
+        book.refresh_from_db()
+        assert book.available_copies == 3
+        assert list(get_messages(response.wsgi_request))[-1].level == messages.ERROR
+
+    def test_bulk_force_return_partial_is_a_warning(
+        self, staff_client, member_user, book, active_loan
+    ):
+        """When only some selected loans were active, staff get a warning
+        saying how many were returned."""
+        returned_loan = Loan.objects.create(member=member_user, book=book, is_active=False)
+        url = lib_url('staff_loan_bulk_force_return')
+        response = staff_client.post(url, {'loan_ids': [active_loan.pk, returned_loan.pk]})
+
+        [message] = get_messages(response.wsgi_request)
+        assert message.level == messages.WARNING
+        assert str(message).startswith('1 of 2 selected')
+
+    def test_bulk_force_return_blocked_by_copy_counts(
+        self, staff_client, book, active_loan
+    ):
+        """If one book has no room for its copy, nothing is returned and
+        staff get a message rather than a 500."""
+        Book.objects.filter(pk=book.pk).update(available_copies=3)
+        url = lib_url('staff_loan_bulk_force_return')
+        response = staff_client.post(url, {'loan_ids': [active_loan.pk]})
+
+        assert response.status_code == 302
+        active_loan.refresh_from_db()
+        assert active_loan.is_active is True
+
+
 @pytest.mark.django_db
 class TestStaffLoanListFiltering:
     """Tests for loan list status filtering."""
 
-    def test_loan_list_filter_active(
-        self, client, staff_user, active_loan
+    @pytest.mark.parametrize('query,expected,num_queries', [
+        ('?status=active', [True], LOAN_LIST_QUERIES),
+        # nothing matches, so no page is fetched
+        ('?status=returned', [], LOAN_LIST_QUERIES - 1),
+        ('', [True], LOAN_LIST_QUERIES + 1),
+    ])
+    def test_loan_list_filter(
+        self, staff_client, active_loan, django_assert_num_queries, query, expected, num_queries
     ):
-        """?status=active shows only active loans."""
-        client.force_login(staff_user)
-        url = reverse('library:staff_loan_list') + '?status=active'
-        response = client.get(url)
+        """?status= narrows the list to active or returned loans; no filter
+        shows all. expected lists the is_active flags of the rows shown."""
+        url = lib_url('staff_loan_list') + query
+        with django_assert_num_queries(num_queries):
+            response = staff_client.get(url)
 
         assert response.status_code == 200
-        loans = response.context['loans']
-        assert all(loan.is_active for loan in loans)
-        assert len(loans) == 1
+        assert [loan.is_active for loan in response.context['loans']] == expected
 
-    def test_loan_list_filter_returned(
-        self, client, staff_user, active_loan
+    def test_loan_list_is_paginated(self, staff_client, member_user, book):
+        """The loan list renders at most one page of loans at a time."""
+        Loan.objects.bulk_create([
+            Loan(member=member_user, book=book, is_active=False)
+            for _ in range(55)
+        ])
+        url = lib_url('staff_loan_list')
+        response = staff_client.get(url)
+
+        assert response.status_code == 200
+        assert response.context['is_paginated'] is True
+        assert len(response.context['loans']) == 50
+
+        response = staff_client.get(url + '?page=2')
+        assert len(response.context['loans']) == 5
+
+    def test_loan_list_paginates_on_the_estimate(
+        self, monkeypatch, staff_client, member_user, book
     ):
-        """?status=returned shows only returned loans (none in this case)."""
-        client.force_login(staff_user)
-        url = reverse('library:staff_loan_list') + '?status=returned'
-        response = client.get(url)
+        """Past the threshold the unfiltered list is paged by the planner's
+        estimate, even when it has drifted from the real row count."""
+        Loan.objects.bulk_create([
+            Loan(member=member_user, book=book, is_active=False)
+            for _ in range(120)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE library_loan')
+        # real count drops to 60 while pg_class still says 120
+        Loan.objects.filter(pk__in=Loan.objects.values('pk')[:60]).delete()
+        monkeypatch.setattr(pagination, 'ESTIMATE_THRESHOLD', 0)
+
+        paginator = EstimatedCountPaginator(Loan.objects.all(), 50)
+        assert paginator.count == 120
+        assert paginator.num_pages == 3
+        assert len(paginator.page(2).object_list) == 10
+        assert len(paginator.page(3).object_list) == 0
+
+        # a filtered list is still counted exactly
+        assert EstimatedCountPaginator(Loan.objects.filter(is_active=False), 50).count == 60
+
+        url = lib_url('staff_loan_list')
+        response = staff_client.get(url + '?page=2')
+        assert response.status_code == 200
+        assert response.context['paginator'].num_pages == 3
+        assert len(response.context['loans']) == 10
+
+    @pytest.mark.parametrize('books_bulk', [1, 10, 100], indirect=True)
+    def test_loan_list_query_count_is_constant(
+        self, staff_client, member_user, books_bulk, django_assert_num_queries
+    ):
+        """The loan list's member and book columns do not add a query per
+        row."""
+        Loan.objects.bulk_create([Loan(member=member_user, book=b) for b in books_bulk])
+        url = lib_url('staff_loan_list')
+
+        with django_assert_num_queries(LOAN_LIST_QUERIES + 1):
+            response = staff_client.get(url)
+
+        assert response.status_code == 200
+
+
+@pytest.mark.django_db
+class TestStaffLoanExport:
+    """Tests for the streamed CSV loan export."""
+
+    def test_loan_export_streams_csv(self, staff_client, member_user, book, active_loan):
+        """The export has a header row plus one row per matching loan."""
+        url = lib_url('staff_loan_export')
+        response = staff_client.get(url + '?status=active')
 
         assert response.status_code == 200
-        loans = response.context['loans']
-        assert len(loans) == 0
+        assert response['Content-Type'] == 'text/csv'
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        assert lines[0] == 'Book,Member,Checked Out,Returned,Status'
+        assert len(lines) == 2
+        assert lines[1].startswith(f'{book.title},{member_user.username},')
+        assert lines[1].endswith(',,Active')
+
+        response = staff_client.get(url + '?status=returned')
+        assert len(b''.join(response.streaming_content).decode().splitlines()) == 1
+
+
+@pytest.mark.django_db
+class TestStaffUserList:
+    """Tests for the staff member list."""
 
-    def test_loan_list_no_filter_shows_all(
-        self, client, staff_user, active_loan
+    def test_user_list_prefetches_active_loans(
+        self, staff_client, member_user, book, active_loan
     ):
-        """No status filter shows all loans."""
-        client.force_login(staff_user)
-        url = reverse('library:staff_loan_list')
-        response = client.get(url)
+        """Each member carries its active loans (with books) so the
+        template does not query per row."""
+        url = lib_url('staff_user_list')
+        response = staff_client.get(url)
 
         assert response.status_code == 200
-        loans = response.context['loans']
-        assert len(loans) == 1
+        member = response.context['members'][0]
+        assert member.active_loan_count == 1
+        assert [loan.book.title for loan in member.active_loans] == [book.title]